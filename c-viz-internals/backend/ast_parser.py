@@ -1,150 +1,183 @@
 """
 AST Parser Service using libclang.
-Parses C source code and generates a recursive JSON AST structure.
+Parses C source code and generates a flat JSON AST node list.
 """
 
-import uuid
-from clang.cindex import Index, CursorKind, Config
-import tempfile
+from clang.cindex import CursorKind
 import os
 
 from static_analyzer import analyze_code
+from clang_driver import INCLUDE_DIR
+from clang_session import SESSION_FILE, file_key, translation_unit
+from result_cache import cached_result
 
+PARSE_ARGS = ['-std=c11', '-I', INCLUDE_DIR]  # Use C11 standard and add include path
 
-def get_cursor_kind_name(cursor_kind: CursorKind) -> str:
-    """Convert CursorKind enum to readable string."""
-    return cursor_kind.name
+
+# CursorKind -> name, computed once so every node shares the same string
+_KIND_NAME = {kind: kind.name for kind in CursorKind.get_all_kinds()}
+
+
+# Wrapper nodes that carry no information of their own; their children are
+# spliced into the parent instead. Looked up by name so kinds missing from
+# this libclang version are simply skipped.
+_WRAPPER_KINDS = {
+    getattr(CursorKind, kind_name)
+    for kind_name in ('UNEXPOSED_EXPR', 'IMPLICIT_CAST_EXPR', 'PAREN_EXPR', 'CSTYLE_CAST_EXPR')
+    if hasattr(CursorKind, kind_name)
+}
+
+# Set CVIZ_AST_KEEP_WRAPPERS=1 to see the raw libclang tree when debugging
+SKIP_WRAPPERS = os.getenv("CVIZ_AST_KEEP_WRAPPERS") != "1"
 
 
 def get_effective_children(cursor):
     """
     Helper to get children, skipping UnexposedExpr wrappers.
     """
-    wrapper_names = {
-        'UNEXPOSED_EXPR',
-        'IMPLICIT_CAST_EXPR',
-        'PAREN_EXPR',
-        'C_STYLE_CAST_EXPR'
-    }
-    
     for child in cursor.get_children():
-        kind_name = child.kind.name
-        # Use string comparison to avoid Enum version mismatches
-        if kind_name in wrapper_names:
-            # Debug: Log when we skip a wrapper
-            # print(f"[AST] Skipping wrapper: {kind_name}")
+        if SKIP_WRAPPERS and child.kind in _WRAPPER_KINDS:
             # If it's a wrapper, get its children instead (recursively)
             yield from get_effective_children(child)
         else:
             yield child
 
 
-def traverse_ast(cursor, main_file: str, depth: int = 0) -> dict:
+def traverse_ast(cursor, main_norm: str, file_cache: dict = None) -> list:
     """
-    Recursively traverse the AST and build a JSON-serializable structure.
+    Traverse the AST and build a flat, JSON-serializable node list.
     Only includes nodes from the main source file.
     
+    Nodes are emitted in pre-order and each one stores the index of its
+    parent ("parent", -1 for the root), so parents always precede their
+    children and siblings keep source order. The frontend rebuilds the tree.
+    Walks iteratively with an explicit stack, so deep ASTs cannot hit the
+    recursion limit.
+    
     Args:
         cursor: clang.cindex.Cursor object
-        main_file: Path to the main source file (to filter out header nodes)
-        depth: Current depth in the tree (for debugging)
+        main_norm: Normalized path of the main source file (to filter out header nodes)
+        file_cache: Optional {file_key: normalized path} cache shared across walks
     
     Returns:
-        dict: Recursive AST node structure
+        list: AST nodes with type, name, line, column and parent
     """
-    # Get the name - cursor.spelling usually has what we need
-    name = cursor.spelling or cursor.displayname or ""
+    if file_cache is None:
+        file_cache = {}
     
-    # Debug: log CALL_EXPR names to verify backend is running
-    if cursor.kind == CursorKind.CALL_EXPR:
-        print(f"[AST] Line {cursor.location.line}: CALL_EXPR name='{name}'")
+    nodes = []
+    child_counts = []
+    # Nodes without file info are only kept if they end up with a name or
+    # children, which is only known once their subtree has been walked.
+    conditional = []  # node indices
+    stack = [(cursor, cursor.location, -1, False)]
     
-
-    node = {
-        "id": str(uuid.uuid4()),
-        "type": get_cursor_kind_name(cursor.kind),
-        "name": name,
-        "line": cursor.location.line if cursor.location.file else 0,
-        "column": cursor.location.column if cursor.location.file else 0,
-        "children": []
-    }
+    while stack:
+        # Each location is fetched once (when the cursor is first seen):
+        # every access goes through ctypes
+        cursor, loc, parent, needs_content = stack.pop()
+        idx = len(nodes)
+        
+        # Get the name - cursor.spelling usually has what we need
+        name = cursor.spelling or cursor.displayname or ""
+        has_file = loc.file is not None
+        
+        nodes.append({
+            "type": _KIND_NAME[cursor.kind],
+            "name": name,
+            "line": loc.line if has_file else 0,
+            "column": loc.column if has_file else 0,
+            "parent": parent
+        })
+        child_counts.append(0)
+        if parent >= 0:
+            child_counts[parent] += 1
+        if needs_content:
+            conditional.append(idx)
+        
+        # Collect children
+        # Use get_effective_children to skip UnexposedExpr wrappers
+        pending = []
+        for child in get_effective_children(cursor):
+            # Only include nodes from the main source file (not included headers)
+            child_loc = child.location
+            child_file = child_loc.file
+            if child_file:
+                # Compare file paths - only include if from main file
+                key = file_key(child_file)
+                child_norm = file_cache.get(key)
+                if child_norm is None:
+                    child_norm = file_cache[key] = os.path.normpath(child_file.name)
+                if child_norm == main_norm:
+                    pending.append((child, child_loc, idx, False))
+            else:
+                # Include nodes without file info (e.g., built-in types)
+                pending.append((child, child_loc, idx, True))
+        
+        # Push in reverse so children are visited (and emitted) in source order
+        stack.extend(reversed(pending))
     
+    if not conditional:
+        return nodes
     
-    # Traverse children
-    # Use get_effective_children to skip UnexposedExpr wrappers
-    for child in get_effective_children(cursor):
-        # Only include nodes from the main source file (not included headers)
-        if child.location.file:
-            # Compare file paths - only include if from main file
-            child_file = child.location.file.name
-            if child_file and os.path.normpath(child_file) == os.path.normpath(main_file):
-                child_node = traverse_ast(child, main_file, depth + 1)
-                node["children"].append(child_node)
-        else:
-            # Include nodes without file info (e.g., built-in types)
-            child_node = traverse_ast(child, main_file, depth + 1)
-            if child_node["children"] or child_node["name"]:
-                node["children"].append(child_node)
+    # Drop empty file-less nodes, deepest first so parents see the final result
+    dropped = set()
+    for idx in reversed(conditional):
+        node = nodes[idx]
+        if not child_counts[idx] and not node["name"]:
+            dropped.add(idx)
+            child_counts[node["parent"]] -= 1
     
-    return node
+    # Compact, remapping parent indices (a dropped node has no kept descendants)
+    new_index = {}
+    kept = []
+    for idx, node in enumerate(nodes):
+        if idx in dropped:
+            continue
+        new_index[idx] = len(kept)
+        if node["parent"] >= 0:
+            node["parent"] = new_index[node["parent"]]
+        kept.append(node)
+    return kept
 
 
-def parse_c_code(source_code: str) -> dict:
+# The wrapper setting changes the tree, so it is part of the cache key
+@cached_result("ast/v4", args=PARSE_ARGS + ([] if SKIP_WRAPPERS else ['keep-wrappers']),
+               watch_dirs=[INCLUDE_DIR])
+def parse_c_code(source_code: str, session_id: str = None) -> dict:
     """
-    Parse C source code and return a recursive AST structure.
+    Parse C source code and return a flat AST structure.
     
     Args:
         source_code: C source code as a string
+        session_id: Optional client session id; keeps that client's TU warm
         
     Returns:
-        dict: Recursive AST structure with id, type, name, line, and children
+        dict: Flat AST node list (see traverse_ast) under "ast"
               Also includes symbolTable and diagnostics from static analysis
     """
-    # Create a temporary file to store the C code
-    # libclang requires a file to parse
-    with tempfile.NamedTemporaryFile(
-        mode='w',
-        suffix='.c',
-        delete=False,
-        encoding='utf-8'
-    ) as tmp_file:
-        tmp_file.write(source_code)
-        tmp_file_path = tmp_file.name
-    
     try:
-        # Get absolute path to backend/include
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        include_dir = os.path.join(current_dir, 'include')
-
-        # Create an index
-        index = Index.create()
-        
-        # Parse the translation unit
-        translation_unit = index.parse(
-            tmp_file_path,
-            args=['-std=c11', '-I', include_dir],  # Use C11 standard and add include path
-            options=0
-        )
-        
-        # Check for parse errors
-        errors = []
-        for diag in translation_unit.diagnostics:
-            if diag.severity >= 3:  # Error or Fatal
-                errors.append({
-                    "severity": diag.severity,
-                    "message": diag.spelling,
-                    "line": diag.location.line,
-                    "column": diag.location.column
-                })
-        
-        # Get the root cursor (translation unit)
-        root_cursor = translation_unit.cursor
-        
-        # Build the AST (only nodes from the main source file)
-        ast = traverse_ast(root_cursor, tmp_file_path)
-        
-        # Run static analysis
-        analysis_result = analyze_code(root_cursor, tmp_file_path)
+        # Parse the translation unit (reused across requests, see clang_session)
+        with translation_unit(source_code, PARSE_ARGS, session_id) as tu:
+            # Check for parse errors
+            errors = []
+            for diag in tu.diagnostics:
+                if diag.severity >= 3:  # Error or Fatal
+                    errors.append({
+                        "severity": diag.severity,
+                        "message": diag.spelling,
+                        "line": diag.location.line,
+                        "column": diag.location.column
+                    })
+            
+            # Get the root cursor (translation unit)
+            root_cursor = tu.cursor
+            
+            # Build the AST (only nodes from the main source file)
+            ast = traverse_ast(root_cursor, os.path.normpath(SESSION_FILE))
+            
+            # Run static analysis
+            analysis_result = analyze_code(root_cursor, SESSION_FILE)
         
         # Add metadata
         result = {
@@ -163,7 +196,3 @@ def parse_c_code(source_code: str) -> dict:
             "ast": None,
             "errors": [{"message": str(e)}]
         }
-    finally:
-        # Clean up temporary file
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
@@ -4,9 +4,21 @@ Constructs CFG from C code AST with basic blocks and control flow edges.
 """
 
 import uuid
-from clang.cindex import Index, CursorKind
-import tempfile
+from clang.cindex import CursorKind
 import os
+from collections import Counter
+
+from clang_session import SESSION_FILE, file_key, translation_unit
+from result_cache import cached_result
+
+CFG_ARGS = ['-std=c11']
+
+# CursorKind members are singletons: bind the ones tested per statement once
+# and compare by identity rather than going through CursorKind.<NAME> lookups
+_FUNCTION_DECL = CursorKind.FUNCTION_DECL
+_VAR_DECL = CursorKind.VAR_DECL
+_COMPOUND_STMT = CursorKind.COMPOUND_STMT
+_RETURN_STMT = CursorKind.RETURN_STMT
 
 
 class BasicBlock:
@@ -17,20 +29,17 @@ class BasicBlock:
         self.label = label
         self.statements = []
         self.successors = []  # List of block IDs
+        self.successor_ids = set()  # Same IDs, for O(1) membership checks
         self.is_entry = False
         self.is_exit = False
     
     def add_statement(self, stmt: str, line: int):
         self.statements.append({"text": stmt, "line": line})
     
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "label": self.label,
-            "statements": self.statements,
-            "isEntry": self.is_entry,
-            "isExit": self.is_exit
-        }
+    def add_successor(self, block_id: str):
+        if block_id not in self.successor_ids:
+            self.successor_ids.add(block_id)
+            self.successors.append(block_id)
 
 
 class CFGBuilder:
@@ -39,10 +48,13 @@ class CFGBuilder:
     def __init__(self):
         self.blocks = {}  # id -> BasicBlock
         self.edges = []
+        self._edge_keys = set()  # (source, target, label) of every edge
         self.current_block = None
         self.block_counter = 0
         self.source_content = ""
         self.source_file = ""
+        self._source_file_norm = ""
+        self._file_cache = {}  # file_key -> is from source file
     
     def new_block(self, label: str = "") -> BasicBlock:
         """Create a new basic block."""
@@ -56,81 +68,119 @@ class CFGBuilder:
     
     def add_edge(self, from_id: str, to_id: str, label: str = ""):
         """Add an edge between two blocks."""
-        edge = {
+        # Avoid duplicate edges
+        key = (from_id, to_id, label)
+        if key in self._edge_keys:
+            return
+        self._edge_keys.add(key)
+        
+        self.edges.append({
             "id": f"edge_{from_id}_{to_id}",
             "source": from_id,
             "target": to_id,
             "label": label
-        }
-        # Avoid duplicate edges
-        if edge not in self.edges:
-            self.edges.append(edge)
-            if to_id not in self.blocks[from_id].successors:
-                self.blocks[from_id].successors.append(to_id)
+        })
+        self.blocks[from_id].add_successor(to_id)
     
-    def build_cfg(self, cursor, source_file: str) -> dict:
+    def build_cfg(self, cursor, source_file: str, source_bytes: bytes = None) -> dict:
         """
         Build CFG from the AST cursor.
         
         Args:
             cursor: Root cursor from libclang
             source_file: Path to source file
+            source_bytes: Source content, if already in memory (read from
+                          source_file otherwise)
             
         Returns:
-            dict with nodes and edges for CFG
+            dict with blocks and edges for CFG as parallel arrays
         """
         self.source_file = source_file
+        self._source_file_norm = os.path.normpath(source_file)
+        self._file_cache = {}
         
-        # Read source content for text extraction
-        # READ AS BINARY to match libclang byte offsets
-        try:
-            with open(source_file, 'rb') as f:
-                self.source_content_bytes = f.read()
-            # We also keep a decoded version if needed, but for extraction we use bytes
-        except Exception as e:
-            print(f"Error reading source file: {e}")
-            self.source_content_bytes = b""
+        # Source content for text extraction
+        # Kept AS BINARY to match libclang byte offsets
+        if source_bytes is not None:
+            self.source_content_bytes = source_bytes
+        else:
+            try:
+                with open(source_file, 'rb') as f:
+                    self.source_content_bytes = f.read()
+            except Exception as e:
+                print(f"Error reading source file: {e}")
+                self.source_content_bytes = b""
         
         # Find function declarations and build CFG for each
         for child in cursor.get_children():
-            if child.kind == CursorKind.FUNCTION_DECL:
-                if self._is_from_source(child):
-                    self._build_function_cfg(child)
+            if child.kind is _FUNCTION_DECL and self._is_from_source(child):
+                self._build_function_cfg(child)
         
         # Clean up orphan blocks (empty blocks with no incoming edges)
         self._cleanup_orphan_blocks()
         
         # Convert to output format
-        nodes = [block.to_dict() for block in self.blocks.values()]
+        return self._emit_soa()
+    
+    def _emit_soa(self) -> dict:
+        """
+        Flatten blocks and edges into parallel arrays (struct-of-arrays).
+        Statements and edges refer to blocks by their index in `block_ids`.
+        """
+        block_ids = []
+        labels = []
+        is_entry = []
+        is_exit = []
+        stmts_text = []
+        stmts_line = []
+        stmts_owner = []
+        block_index = {}
+        
+        for idx, block in enumerate(self.blocks.values()):
+            block_index[block.id] = idx
+            block_ids.append(block.id)
+            labels.append(block.label)
+            is_entry.append(block.is_entry)
+            is_exit.append(block.is_exit)
+            for stmt in block.statements:
+                stmts_text.append(stmt["text"])
+                stmts_line.append(stmt["line"])
+                stmts_owner.append(idx)
         
         return {
-            "nodes": nodes,
-            "edges": self.edges
+            "block_ids": block_ids,
+            "labels": labels,
+            "is_entry": is_entry,
+            "is_exit": is_exit,
+            "stmts_text": stmts_text,
+            "stmts_line": stmts_line,
+            "stmts_owner": stmts_owner,
+            "edges_src": [block_index[edge["source"]] for edge in self.edges],
+            "edges_tgt": [block_index[edge["target"]] for edge in self.edges],
+            "edges_label": [edge["label"] for edge in self.edges]
         }
     
     def _cleanup_orphan_blocks(self):
         """Remove empty blocks that have no incoming edges and no statements."""
-        # Find blocks that are targets of edges
-        target_blocks = set()
-        for edge in self.edges:
-            target_blocks.add(edge["target"])
-        
-        # Find orphan blocks to remove
-        orphans = []
-        for block_id, block in self.blocks.items():
-            # Keep entry/exit blocks
-            if block.is_entry or block.is_exit:
-                continue
-            # Remove if: no statements AND (no incoming edges OR no outgoing edges)
-            if len(block.statements) == 0:
-                if block_id not in target_blocks or len(block.successors) == 0:
-                    orphans.append(block_id)
-        
-        # Remove orphan blocks
-        for block_id in orphans:
-            del self.blocks[block_id]
+        # Incoming edge count per block
+        in_degree = Counter(edge["target"] for edge in self.edges)
+        
+        # Remove if: no statements AND (no incoming edges OR no outgoing edges)
+        # Entry/exit blocks are always kept
+        orphans = {
+            block_id for block_id, block in self.blocks.items()
+            if not block.statements
+            and not (block.is_entry or block.is_exit)
+            and (not in_degree[block_id] or not block.successors)
+        }
+        if not orphans:
+            return
         
-        # Remove edges referencing orphan blocks
+        # Remove orphan blocks and edges referencing them
+        self.blocks = {
+            block_id: block for block_id, block in self.blocks.items()
+            if block_id not in orphans
+        }
         self.edges = [
             edge for edge in self.edges
             if edge["source"] not in orphans and edge["target"] not in orphans
@@ -138,9 +188,16 @@ class CFGBuilder:
     
     def _is_from_source(self, cursor) -> bool:
         """Check if cursor is from our source file."""
-        if cursor.location.file:
-            return cursor.location.file.name == self.source_file
-        return False
+        source_file = cursor.location.file
+        if not source_file:
+            return False
+        key = file_key(source_file)
+        from_source = self._file_cache.get(key)
+        if from_source is None:
+            from_source = self._file_cache[key] = (
+                os.path.normpath(source_file.name) == self._source_file_norm
+            )
+        return from_source
 
     def _get_cursor_text(self, cursor) -> str:
         """Extract exact text from source for a given cursor."""
@@ -149,8 +206,9 @@ class CFGBuilder:
             
         # libclang extents are 1-based line, 1-based column
         # But offsets are simpler if available
-        start_offset = cursor.extent.start.offset
-        end_offset = cursor.extent.end.offset
+        extent = cursor.extent
+        start_offset = extent.start.offset
+        end_offset = extent.end.offset
         
         if 0 <= start_offset < len(self.source_content_bytes) and 0 < end_offset <= len(self.source_content_bytes):
             extracted_bytes = self.source_content_bytes[start_offset:end_offset]
@@ -163,45 +221,53 @@ class CFGBuilder:
 
     def _get_statement_text(self, cursor) -> str:
         """Get a readable representation of a statement."""
-        kind = cursor.kind
-        name = cursor.spelling or ""
-        
-        if kind == CursorKind.RETURN_STMT:
-            # Try to get full return statement text
-            text = self._get_cursor_text(cursor)
-            return text if text else "return"
-        elif kind == CursorKind.CALL_EXPR:
-            return f"{name}()"
-        elif kind == CursorKind.VAR_DECL:
-            # improved: get full declaration
-            text = self._get_cursor_text(cursor)
-            # truncate if too long
-            if len(text) > 30:
-                return f"{text[:27]}..."
-            return text if text else f"int {name}"
-        elif kind == CursorKind.BINARY_OPERATOR:
-             # improved: get full expression
-            text = self._get_cursor_text(cursor)
+        handler = _STMT_HANDLERS.get(cursor.kind)
+        if handler:
+            return handler(self, cursor)
+        return self._fallback_text(cursor)
+    
+    def _return_text(self, cursor) -> str:
+        # Try to get full return statement text
+        text = self._get_cursor_text(cursor)
+        return text if text else "return"
+    
+    def _call_text(self, cursor) -> str:
+        return f"{cursor.spelling or ''}()"
+    
+    def _var_decl_text(self, cursor) -> str:
+        # improved: get full declaration
+        text = self._get_cursor_text(cursor)
+        # truncate if too long
+        if len(text) > 30:
+            return f"{text[:27]}..."
+        return text if text else f"int {cursor.spelling or ''}"
+    
+    def _binary_operator_text(self, cursor) -> str:
+        # improved: get full expression
+        text = self._get_cursor_text(cursor)
+        if len(text) > 30:
+            return f"{text[:27]}..."
+        return text if text else f"{cursor.spelling or ''} = ..."
+    
+    def _decl_stmt_text(self, cursor) -> str:
+        # Get variable name from children
+        for child in cursor.get_children():
+            if child.kind is _VAR_DECL:
+                text = self._get_cursor_text(child)
+                return text if text else f"decl {child.spelling}"
+        return "decl"
+    
+    def _compound_text(self, cursor) -> str:
+        return None  # Don't add compound statements
+    
+    def _fallback_text(self, cursor) -> str:
+        # Fallback to source text
+        text = self._get_cursor_text(cursor)
+        if text:
             if len(text) > 30:
                 return f"{text[:27]}..."
-            return text if text else f"{name} = ..."
-        elif kind == CursorKind.DECL_STMT:
-            # Get variable name from children
-            for child in cursor.get_children():
-                if child.kind == CursorKind.VAR_DECL:
-                    text = self._get_cursor_text(child)
-                    return text if text else f"decl {child.spelling}"
-            return "decl"
-        elif kind == CursorKind.COMPOUND_STMT:
-            return None  # Don't add compound statements
-        else:
-            # Fallback to source text
-            text = self._get_cursor_text(cursor)
-            if text:
-                 if len(text) > 30:
-                    return f"{text[:27]}..."
-                 return text
-            return kind.name.replace('_', ' ').lower()
+            return text
+        return _KIND_LABEL[cursor.kind]
     
     def _build_function_cfg(self, func_cursor):
         """Build CFG for a single function."""
@@ -217,45 +283,43 @@ class CFGBuilder:
         
         # Find the compound statement (function body)
         for child in func_cursor.get_children():
-            if child.kind == CursorKind.COMPOUND_STMT:
+            if child.kind is _COMPOUND_STMT:
                 # Process the function body
                 last_block = self._process_block(child, entry_block, exit_block)
                 
                 # Connect last block to exit if not already connected
                 if last_block and last_block.id != exit_block.id:
-                    if exit_block.id not in last_block.successors:
+                    if exit_block.id not in last_block.successor_ids:
                         self.add_edge(last_block.id, exit_block.id)
     
     def _process_block(self, cursor, current_block: BasicBlock, exit_block: BasicBlock) -> BasicBlock:
         """
         Process statements and build CFG structure.
         Returns the last block in the sequence.
+        
+        Nested compound statements are flattened with a worklist of child
+        iterators instead of recursing into this method.
         """
-        for child in cursor.get_children():
+        worklist = [cursor.get_children()]
+        while worklist:
+            child = next(worklist[-1], None)
+            if child is None:
+                # Finished this compound statement, resume the enclosing one
+                worklist.pop()
+                continue
+            
             if not self._is_from_source(child):
                 continue
                 
             kind = child.kind
+            handler = _BLOCK_HANDLERS.get(kind)
             
-            if kind == CursorKind.IF_STMT:
-                current_block = self._process_if(child, current_block, exit_block)
-            
-            elif kind == CursorKind.WHILE_STMT:
-                current_block = self._process_while(child, current_block, exit_block)
+            if handler:
+                # Control flow - returns the block that follows it
+                current_block = handler(self, child, current_block, exit_block)
             
-            elif kind == CursorKind.FOR_STMT:
-                current_block = self._process_for(child, current_block, exit_block)
-            
-            elif kind == CursorKind.RETURN_STMT:
-                # Use source text for return
-                stmt_text = self._get_cursor_text(child)
-                current_block.add_statement(stmt_text or "return", child.location.line)
-                self.add_edge(current_block.id, exit_block.id)
-                # Create new block for unreachable code
-                current_block = self.new_block()
-            
-            elif kind == CursorKind.COMPOUND_STMT:
-                current_block = self._process_block(child, current_block, exit_block)
+            elif kind is _COMPOUND_STMT:
+                worklist.append(child.get_children())
             
             else:
                 # Regular statement - add to current block
@@ -265,6 +329,15 @@ class CFGBuilder:
         
         return current_block
     
+    def _process_return(self, cursor, current_block: BasicBlock, exit_block: BasicBlock) -> BasicBlock:
+        """Process return statement."""
+        # Use source text for return
+        stmt_text = self._get_cursor_text(cursor)
+        current_block.add_statement(stmt_text or "return", cursor.location.line)
+        self.add_edge(current_block.id, exit_block.id)
+        # Create new block for unreachable code
+        return self.new_block()
+    
     def _process_if(self, cursor, current_block: BasicBlock, exit_block: BasicBlock) -> BasicBlock:
         """Process if statement."""
         children = list(cursor.get_children())
@@ -295,7 +368,7 @@ class CFGBuilder:
         # Process then branch (child 1)
         if len(children) > 1:
             last_then = self._process_block_single(children[1], then_block, exit_block)
-            if last_then and exit_block.id not in last_then.successors:
+            if last_then and exit_block.id not in last_then.successor_ids:
                 self.add_edge(last_then.id, merge_block.id)
         
         # Check for else branch (child 2)
@@ -303,7 +376,7 @@ class CFGBuilder:
             else_block = self.new_block("else")
             self.add_edge(current_block.id, else_block.id, "false")
             last_else = self._process_block_single(children[2], else_block, exit_block)
-            if last_else and exit_block.id not in last_else.successors:
+            if last_else and exit_block.id not in last_else.successor_ids:
                 self.add_edge(last_else.id, merge_block.id)
         else:
             # No else - direct edge to merge
@@ -345,7 +418,7 @@ class CFGBuilder:
         if len(children) > 1:
             last_body = self._process_block_single(children[1], body_block, exit_block)
             # Back edge - THIS CREATES THE CYCLE
-            if last_body and exit_block.id not in last_body.successors:
+            if last_body and exit_block.id not in last_body.successor_ids:
                 self.add_edge(last_body.id, cond_block.id, "loop back")
         
         return after_loop
@@ -353,6 +426,7 @@ class CFGBuilder:
     def _process_for(self, cursor, current_block: BasicBlock, exit_block: BasicBlock) -> BasicBlock:
         """Process for loop - similar to while but with init and inc."""
         children = list(cursor.get_children())
+        line = cursor.location.line  # Shared by the init/cond/inc blocks
         
         # For loops in Clang can be tricky.
         # They usually have: Init (optional), Check (optional), Update (optional), Body.
@@ -434,9 +508,9 @@ class CFGBuilder:
         init_block = self.new_block("for init")
         if init_c and init_c != body_c:
              init_text = self._get_cursor_text(init_c)
-             init_block.add_statement(init_text if init_text else "init", cursor.location.line)
+             init_block.add_statement(init_text if init_text else "init", line)
         else:
-             init_block.add_statement("for init", cursor.location.line)
+             init_block.add_statement("for init", line)
              
         self.add_edge(current_block.id, init_block.id)
         
@@ -444,9 +518,9 @@ class CFGBuilder:
         cond_block = self.new_block("for cond")
         if cond_c and cond_c != body_c:
              cond_text = self._get_cursor_text(cond_c)
-             cond_block.add_statement(f"for ({cond_text})", cursor.location.line)
+             cond_block.add_statement(f"for ({cond_text})", line)
         else:
-             cond_block.add_statement("for cond", cursor.location.line)
+             cond_block.add_statement("for cond", line)
              
         self.add_edge(init_block.id, cond_block.id)
         
@@ -454,9 +528,9 @@ class CFGBuilder:
         inc_block = self.new_block("for inc")
         if inc_c and inc_c != body_c:
              inc_text = self._get_cursor_text(inc_c)
-             inc_block.add_statement(inc_text if inc_text else "inc", cursor.location.line)
+             inc_block.add_statement(inc_text if inc_text else "inc", line)
         else:
-              inc_block.add_statement("inc", cursor.location.line)
+              inc_block.add_statement("inc", line)
 
         # Body block
         body_block = self.new_block("for body")
@@ -472,7 +546,7 @@ class CFGBuilder:
         
         # Process body
         if body_c:
-            if body_c.kind == CursorKind.COMPOUND_STMT:
+            if body_c.kind is _COMPOUND_STMT:
                 last_body = self._process_block(body_c, body_block, exit_block)
             else:
                  # Single stmt body
@@ -482,7 +556,7 @@ class CFGBuilder:
                 last_body = body_block
             
             # Back edge: Body -> Inc -> Cond
-            if last_body and exit_block.id not in last_body.successors:
+            if last_body and exit_block.id not in last_body.successor_ids:
                 # Instead of going straight to Cond, go to Inc
                 self.add_edge(last_body.id, inc_block.id)
                 self.add_edge(inc_block.id, cond_block.id, "loop back")
@@ -495,50 +569,61 @@ class CFGBuilder:
     
     def _process_block_single(self, cursor, block: BasicBlock, exit_block: BasicBlock) -> BasicBlock:
         """Process a single statement or compound statement."""
-        if cursor.kind == CursorKind.COMPOUND_STMT:
+        if cursor.kind is _COMPOUND_STMT:
             return self._process_block(cursor, block, exit_block)
         else:
             stmt_text = self._get_statement_text(cursor)
             if stmt_text:
                 block.add_statement(stmt_text, cursor.location.line)
             
-            if cursor.kind == CursorKind.RETURN_STMT:
+            if cursor.kind is _RETURN_STMT:
                 self.add_edge(block.id, exit_block.id)
                 return None
             
             return block
 
 
-def build_cfg(source_code: str) -> dict:
+# CursorKind -> fallback statement label, e.g. "null stmt"
+_KIND_LABEL = {kind: kind.name.replace('_', ' ').lower() for kind in CursorKind.get_all_kinds()}
+
+# Statement kind -> CFGBuilder method producing its display text
+_STMT_HANDLERS = {
+    CursorKind.RETURN_STMT: CFGBuilder._return_text,
+    CursorKind.CALL_EXPR: CFGBuilder._call_text,
+    CursorKind.VAR_DECL: CFGBuilder._var_decl_text,
+    CursorKind.BINARY_OPERATOR: CFGBuilder._binary_operator_text,
+    CursorKind.DECL_STMT: CFGBuilder._decl_stmt_text,
+    CursorKind.COMPOUND_STMT: CFGBuilder._compound_text,
+}
+
+# Control-flow kind -> CFGBuilder method returning the block that follows it
+_BLOCK_HANDLERS = {
+    CursorKind.IF_STMT: CFGBuilder._process_if,
+    CursorKind.WHILE_STMT: CFGBuilder._process_while,
+    CursorKind.FOR_STMT: CFGBuilder._process_for,
+    CursorKind.RETURN_STMT: CFGBuilder._process_return,
+}
+
+
+@cached_result("cfg/soa/v2", args=CFG_ARGS)
+def build_cfg(source_code: str, session_id: str = None) -> dict:
     """
     Build CFG from C source code.
     
     Args:
         source_code: C source code string
+        session_id: Optional client session id; keeps that client's TU warm
         
     Returns:
-        dict with nodes and edges for CFG visualization
+        dict with the CFG as parallel arrays (see CFGBuilder._emit_soa)
     """
-    # Create temp file
-    with tempfile.NamedTemporaryFile(
-        mode='w',
-        suffix='.c',
-        delete=False,
-        encoding='utf-8'
-    ) as tmp_file:
-        tmp_file.write(source_code)
-        tmp_file_path = tmp_file.name
-    
     try:
-        index = Index.create()
-        translation_unit = index.parse(
-            tmp_file_path,
-            args=['-std=c11'],
-            options=0
-        )
-        
-        builder = CFGBuilder()
-        cfg = builder.build_cfg(translation_unit.cursor, tmp_file_path)
+        # Parse the translation unit (reused across requests, see clang_session)
+        # Encode once: libclang and the builder both work on the same bytes
+        source_bytes = source_code.encode('utf-8')
+        with translation_unit(source_bytes, CFG_ARGS, session_id) as tu:
+            builder = CFGBuilder()
+            cfg = builder.build_cfg(tu.cursor, SESSION_FILE, source_bytes)
         
         return {
             "success": True,
@@ -549,11 +634,5 @@ def build_cfg(source_code: str) -> dict:
         return {
             "success": False,
             "error": str(e),
-            "cfg": {"nodes": [], "edges": []}
+            "cfg": CFGBuilder()._emit_soa()
         }
-    finally:
-        if os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-            except:
-                pass
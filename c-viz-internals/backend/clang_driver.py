@@ -0,0 +1,171 @@
+"""
+clang Driver.
+Resolves the clang executable once and warms it up at server startup, so the
+first /api/optimize and /api/preprocess requests don't pay for a cold
+libLLVM load and the builtin header lookups.
+"""
+
+import asyncio
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+# Resolved once instead of searching PATH on every spawn
+CLANG = shutil.which("clang") or "clang"
+
+# Seconds a single clang run may take before it is killed
+CLANG_TIMEOUT = float(os.getenv("CVIZ_CLANG_TIMEOUT", "30"))
+
+# clang processes allowed to run at once; more just thrash the CPUs.
+# Defaults to all cores but one, and at least two so O0 and O3 still overlap
+CLANG_CONCURRENCY = max(1, int(os.getenv("CVIZ_CLANG_CONCURRENCY", max(2, (os.cpu_count() or 1) - 1))))
+_clang_slots = asyncio.Semaphore(CLANG_CONCURRENCY)
+
+# backend/include, shared by every libclang and clang invocation
+INCLUDE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include')
+
+# Optional: only some LLVM distributions ship clang-stat-cache
+CLANG_STAT_CACHE = shutil.which("clang-stat-cache")
+STAT_CACHE_PATH = os.path.join(tempfile.gettempdir(), "cviz-include.statcache")
+
+_stat_cache_ready = False
+
+WARM_UP_SOURCE = b"#include <stdio.h>\nint main(void) { return 0; }\n"
+
+
+async def run_clang(args: list, source_bytes: bytes) -> tuple:
+    """
+    Run clang with `source_bytes` on stdin without blocking the event loop.
+    At most CLANG_CONCURRENCY runs are in flight; the rest wait their turn
+    (the timeout only starts once clang is spawned).
+    
+    Args:
+        args: clang arguments (without the executable)
+        source_bytes: Input fed to clang's stdin
+        
+    Returns:
+        (returncode, stdout bytes, stderr bytes)
+    """
+    async with _clang_slots:
+        process = await asyncio.create_subprocess_exec(
+            CLANG, *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(source_bytes), CLANG_TIMEOUT)
+        except asyncio.TimeoutError:
+            await _kill(process)
+            raise TimeoutError(f"clang did not finish within {CLANG_TIMEOUT:g}s")
+        except asyncio.CancelledError:
+            # e.g. the client went away mid-stream: don't leave clang running
+            await _kill(process)
+            raise
+        return process.returncode, stdout, stderr
+
+
+async def _kill(process):
+    """Kill a clang process that is still running and reap it."""
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+def _newest_mtime(path: str) -> float:
+    """Latest mtime of a directory and everything below it."""
+    newest = os.stat(path).st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+    return newest
+
+
+def build_stat_cache():
+    """
+    Precompute a stat cache for backend/include with clang-stat-cache, so
+    clang can answer header lookups without stat-ing the tree on every run.
+    The cache is only rebuilt when the include directory changed.
+    """
+    global _stat_cache_ready
+    if not CLANG_STAT_CACHE:
+        return
+
+    try:
+        if (not os.path.isfile(STAT_CACHE_PATH) or
+                os.stat(STAT_CACHE_PATH).st_mtime < _newest_mtime(INCLUDE_DIR)):
+            process = subprocess.run(
+                [CLANG_STAT_CACHE, INCLUDE_DIR, '-o', STAT_CACHE_PATH],
+                capture_output=True,
+                check=False
+            )
+            if process.returncode != 0:
+                print(f"[Backend] clang-stat-cache failed: {process.stderr.decode('utf-8', errors='replace')}")
+                return
+        _stat_cache_ready = True
+    except OSError as e:
+        print(f"[Backend] Could not build include stat cache: {e}")
+
+
+def stat_cache_flags() -> list:
+    """Extra clang flags that use the include stat cache, once it is built."""
+    if not _stat_cache_ready:
+        return []
+    return ['-Xclang', '-ivfsstatcache', '-Xclang', STAT_CACHE_PATH]
+
+
+def cc1_args(driver_args: list):
+    """
+    Ask the driver (clang -###) which job `driver_args` expands to, so the
+    frontend can later be run as `clang -cc1 ...` without the driver step.
+    
+    Args:
+        driver_args: clang driver arguments (without the executable)
+        
+    Returns:
+        The job's arguments from -cc1 on, or None when clang isn't available
+        or the command isn't a single -cc1 job
+    """
+    try:
+        process = subprocess.run(
+            [CLANG, '-###'] + driver_args,
+            capture_output=True,
+            check=False
+        )
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+
+    # Jobs are printed one per line as quoted argv; other lines are banners
+    jobs = [
+        shlex.split(line)
+        for line in process.stderr.decode('utf-8', errors='replace').splitlines()
+        if line.startswith(' "')
+    ]
+    if len(jobs) != 1 or jobs[0][1:2] != ['-cc1']:
+        return None
+    return jobs[0][1:]
+
+
+def warm_up():
+    """
+    Run one throwaway compile so clang's binary, shared libraries and system
+    headers are in the OS page cache before real requests arrive.
+    """
+    build_stat_cache()
+    try:
+        subprocess.run(
+            [CLANG, '-fsyntax-only', '-x', 'c', '-'],
+            input=WARM_UP_SOURCE,
+            capture_output=True,
+            check=False
+        )
+        print(f"[Backend] clang warmed up ({CLANG})")
+    except OSError as e:
+        print(f"[Backend] Could not warm up clang: {e}")
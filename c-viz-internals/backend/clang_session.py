@@ -0,0 +1,88 @@
+"""
+libclang Session.
+Keeps one libclang Index per process and reuses TranslationUnits across
+requests. Headers are parsed once into a precompiled preamble; later requests
+only reparse the in-memory source, so no temp file is ever written.
+Each client session gets its own TranslationUnit (bounded LRU), so one
+client's edits don't throw away another client's preamble.
+"""
+
+import ctypes
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from clang.cindex import Index, TranslationUnit
+
+# Virtual path for the in-memory source. It is never written to disk.
+SESSION_FILE = os.path.join(tempfile.gettempdir(), f"c-viz-session-{os.getpid()}.c")
+
+PARSE_OPTIONS = (
+    TranslationUnit.PARSE_PRECOMPILED_PREAMBLE |
+    TranslationUnit.PARSE_CACHE_COMPLETION_RESULTS
+)
+
+# TranslationUnits kept alive at once, across all sessions and argument sets
+MAX_TRANSLATION_UNITS = max(1, int(os.getenv("CVIZ_MAX_TRANSLATION_UNITS", "16")))
+
+_index = None
+_tu_by_key = OrderedDict()  # (session id, tuple(args)) -> TranslationUnit (most recently used last)
+_lock = threading.Lock()
+
+
+def get_index() -> Index:
+    """
+    Return the shared Index.
+    Created lazily: libclang must be configured before the first Index exists.
+    """
+    global _index
+    if _index is None:
+        _index = Index.create()
+    return _index
+
+
+def file_key(source_file) -> int:
+    """
+    Stable identity of a libclang File within its TU.
+    cindex builds a new File wrapper on every access, so wrappers can't be
+    used as dict keys themselves; the underlying CXFile handle can.
+    """
+    return ctypes.cast(source_file.obj, ctypes.c_void_p).value
+
+
+@contextmanager
+def translation_unit(source_code, args, session_id=None):
+    """
+    Parse `source_code` (str, or UTF-8 bytes) and yield its TranslationUnit.
+
+    The TU is reused (and reparsed) by the next call with the same session id
+    and args, so cursors must not be used after the `with` block exits.
+    Calls without a session id share one TU per argument set.
+    """
+    key = (session_id, tuple(args))
+    unsaved_files = [(SESSION_FILE, source_code)]
+
+    with _lock:
+        tu = _tu_by_key.get(key)
+        try:
+            if tu is None:
+                tu = get_index().parse(
+                    SESSION_FILE,
+                    args=list(args),
+                    unsaved_files=unsaved_files,
+                    options=PARSE_OPTIONS
+                )
+                _tu_by_key[key] = tu
+                while len(_tu_by_key) > MAX_TRANSLATION_UNITS:
+                    _tu_by_key.popitem(last=False)
+            else:
+                _tu_by_key.move_to_end(key)
+                tu.reparse(unsaved_files=unsaved_files)
+        except Exception:
+            # Start from a fresh TU next time rather than reusing a broken one
+            _tu_by_key.pop(key, None)
+            raise
+
+        yield tu
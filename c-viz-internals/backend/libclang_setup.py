@@ -1,45 +1,130 @@
-import glob
 import os
 from clang.cindex import Config
 
-def configure_libclang():
+# Package directories the bundled library lives in
+# The 'libclang' PyPI package typically puts it in 'native' folder or root of package
+BUNDLED_LIB_DIRS = [
+    os.path.join('libclang', 'native'),
+    os.path.join('libclang', 'lib'),
+    os.path.join('clang', 'native'),
+    'clang'
+]
+
+# System library directories, searched after any /usr/lib/llvm-*/lib
+SYSTEM_LIB_DIRS = [
+    '/usr/lib/x86_64-linux-gnu',
+    '/usr/lib/aarch64-linux-gnu',
+    '/usr/lib64',
+    '/usr/local/lib',
+    '/usr/lib'
+]
+
+
+def _cached_libclang_path():
+    """Return a libclang path set by the environment or a parent process, if it exists."""
+    path = os.environ.get("CVIZ_LIBCLANG_PATH")
+    return path if path and os.path.isfile(path) else None
+
+
+def _remember_libclang_path(path: str):
+    """
+    Share the resolved path with child processes (reload/worker forks).
+    Only through the environment: a file would leak into other venvs whose
+    cindex bindings may not match this libclang.
+    """
+    os.environ["CVIZ_LIBCLANG_PATH"] = path
+
+
+def _is_libclang(name: str) -> bool:
+    """Match libclang.so, libclang.so.1, libclang-18.so... but not libclang-cpp."""
+    return (name.startswith('libclang') and not name.startswith('libclang-cpp')
+            and name.endswith(('.so', '.so.1')))
+
+
+def _find_libclang_in(directory: str):
+    """Return the libclang shared library directly inside `directory`, if any."""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if _is_libclang(entry.name) and entry.is_file():
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+
+def _find_system_libclang():
+    """Look for a system-wide libclang, newest LLVM install first."""
+    lib_dirs = []
+    try:
+        with os.scandir('/usr/lib') as entries:
+            llvm_dirs = [entry.name for entry in entries if entry.name.startswith('llvm-')]
+        # llvm-18 before llvm-9: compare the numeric suffix
+        llvm_dirs.sort(key=lambda name: int(name[5:]) if name[5:].isdigit() else -1, reverse=True)
+        lib_dirs.extend(os.path.join('/usr/lib', name, 'lib') for name in llvm_dirs)
+    except OSError:
+        pass
+    lib_dirs.extend(SYSTEM_LIB_DIRS)
+
+    for lib_dir in lib_dirs:
+        found_lib = _find_libclang_in(lib_dir)
+        if found_lib:
+            return found_lib
+    return None
+
+
+def configure_libclang(allow_system_fallback: bool = True):
     """
     Manually configure libclang path if not found automatically.
     This is necessary for some Docker environments (Debian/Ubuntu).
+
+    Args:
+        allow_system_fallback: Fall back to a system libclang when the bundled
+            one is missing. Forced off by CVIZ_STRICT_LIBCLANG=1.
     """
     if Config.library_file:
         return
 
+    cached_lib = _cached_libclang_path()
+    if cached_lib:
+        Config.set_library_file(cached_lib)
+        return
+
     # Search in all python paths (site-packages)
     import sys
-    
+
     print(f"[Backend] Searching for libclang in sys.path...")
-    
+
     found_lib = None
-    
-    # Patterns to look for the bundled library
-    # The 'libclang' PyPI package typically puts it in 'native' folder or root of package
-    relative_patterns = [
-        os.path.join('libclang', 'native', 'libclang.so'),
-        os.path.join('libclang', 'lib', 'libclang.so'),
-        os.path.join('clang', 'native', 'libclang.so'),
-        os.path.join('clang', 'libclang.so')
-    ]
 
+    # One directory read per candidate instead of probing each file name
     for path in sys.path:
-        for pattern in relative_patterns:
-            full_path = os.path.join(path, pattern)
-            if os.path.exists(full_path):
-                found_lib = full_path
+        for lib_dir in BUNDLED_LIB_DIRS:
+            found_lib = _find_libclang_in(os.path.join(path, lib_dir))
+            if found_lib:
                 break
         if found_lib:
             break
-            
+
     if found_lib:
         print(f"[Backend] Found bundled libclang at: {found_lib}")
         Config.set_library_file(found_lib)
+        _remember_libclang_path(found_lib)
+        return
+
+    print("[Backend] CRITICAL: Could not find bundled libclang in site-packages.")
+    print(f"[Backend] sys.path checked: {sys.path}")
+
+    # Strict mode does NOT fall back to system paths, to avoid a version mismatch
+    # (e.g. v19) with the Python bindings: if this fails, we want it to fail here
+    # so we know the pip install didn't work as expected.
+    if not allow_system_fallback or os.getenv("CVIZ_STRICT_LIBCLANG") == "1":
+        return
+
+    system_lib = _find_system_libclang()
+    if system_lib:
+        # Not remembered: the next start should pick up a fixed bundle again
+        print(f"[Backend] WARNING: Falling back to system libclang at: {system_lib}")
+        Config.set_library_file(system_lib)
     else:
-        print("[Backend] CRITICAL: Could not find bundled libclang in site-packages.")
-        print(f"[Backend] sys.path checked: {sys.path}")
-        # We purposely do NOT fallback to system paths to avoid the v19 mismatch.
-        # If this fails, we want it to fail here so we know the pip install didn't work as expected.
+        print("[Backend] CRITICAL: No system libclang found either.")
@@ -1,11 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from typing import Optional
+
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+import orjson
 
 from ast_parser import parse_c_code
 from cfg_builder import build_cfg
 from preprocessor import preprocess_c_code
-from optimizer import optimize_code
+from optimizer import prepare_cc1_args, stream_optimize
+from clang_driver import warm_up
 
 from libclang_setup import configure_libclang
 
@@ -18,7 +26,26 @@ except Exception as e:
 
 import os
 
-app = FastAPI(title="C-Viz Internals API")
+
+def prepare_clang():
+    """Warm clang up, then capture the -cc1 commands the optimizer runs."""
+    # Runs as a fire-and-forget executor job: log failures here, since
+    # nothing awaits the future. Requests still work without the warm-up.
+    try:
+        warm_up()
+        prepare_cc1_args()
+    except Exception as e:
+        print(f"[Startup] Error preparing clang: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm clang off the event loop so startup stays responsive
+    asyncio.get_running_loop().run_in_executor(None, prepare_clang)
+    yield
+
+
+app = FastAPI(title="C-Viz Internals API", lifespan=lifespan)
 
 # Get allowed origins from environment variable
 origins_env = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:5174")
@@ -40,6 +67,15 @@ class ParseRequest(BaseModel):
     """Request model for C code parsing."""
     code: str
 
+
+def json_response(result: dict) -> Response:
+    """
+    Serialize a service result with orjson.
+    Bypasses FastAPI's jsonable_encoder + stdlib json, which dominate
+    response time for large ASTs/CFGs.
+    """
+    return Response(content=orjson.dumps(result), media_type="application/json")
+
 # ... existing endpoints ...
 
 @app.get("/")
@@ -52,9 +88,14 @@ async def root():
 async def optimize_source_code(request: ParseRequest):
     """
     Generate optimized vs unoptimized LLVM IR.
+    Streamed as NDJSON: one {"level", "ir"} line per optimization level as
+    soon as it compiles, then a final {"success", "error"?} line.
     """
-    result = optimize_code(request.code)
-    return result
+    events = stream_optimize(request.code)
+    return StreamingResponse(
+        (orjson.dumps(event) + b"\n" async for event in events),
+        media_type="application/x-ndjson"
+    )
 
 
 @app.get("/api/health")
@@ -64,21 +105,23 @@ async def health_check():
 
 
 @app.post("/api/parse")
-async def parse_code(request: ParseRequest):
+async def parse_code(request: ParseRequest, x_session_id: Optional[str] = Header(None)):
     """
     Parse C source code and return AST structure.
+    The optional X-Session-Id header keeps a libclang TU warm per client.
     """
-    result = parse_c_code(request.code)
-    return result
+    result = parse_c_code(request.code, session_id=x_session_id)
+    return json_response(result)
 
 
 @app.post("/api/cfg")
-async def get_cfg(request: ParseRequest):
+async def get_cfg(request: ParseRequest, x_session_id: Optional[str] = Header(None)):
     """
     Build Control Flow Graph from C source code.
+    The optional X-Session-Id header keeps a libclang TU warm per client.
     """
-    result = build_cfg(request.code)
-    return result
+    result = build_cfg(request.code, session_id=x_session_id)
+    return json_response(result)
 
 
 @app.post("/api/preprocess")
@@ -86,5 +129,5 @@ async def preprocess_code(request: ParseRequest):
     """
     Run C preprocessor to expand macros and includes.
     """
-    result = preprocess_c_code(request.code)
-    return result
+    result = await preprocess_c_code(request.code)
+    return json_response(result)
@@ -3,81 +3,128 @@ Optimizer Service using clang.
 Runs clang to generate LLVM IR with different optimization levels (O0 vs O3).
 """
 
-import subprocess
-import tempfile
-import os
+import asyncio
 
-def optimize_code(source_code: str) -> dict:
+import result_cache
+from clang_driver import INCLUDE_DIR, cc1_args, run_clang, stat_cache_flags
+
+IR_FLAGS = ['-S', '-emit-llvm', '-I', INCLUDE_DIR]
+OPT_LEVELS = ('o0', 'o3')
+IR_CACHE_ARGS = IR_FLAGS + ['-O0', '-O3']
+
+_cc1_args_by_level = {}  # opt level -> captured `clang -cc1` arguments
+
+
+def _driver_args(opt_level: str) -> list:
+    """clang driver arguments emitting LLVM IR for stdin at the given optimization level."""
+    return IR_FLAGS + stat_cache_flags() + [opt_level, '-x', 'c', '-', '-o', '-']
+
+
+def prepare_cc1_args():
+    """
+    Capture the -cc1 command each optimization level expands to, so requests
+    skip the driver's toolchain/target/resource-dir resolution. Run after
+    warm_up(): the captured arguments include the stat cache flags.
+    """
+    for level in OPT_LEVELS:
+        opt_level = f"-{level.upper()}"
+        args = cc1_args(_driver_args(opt_level))
+        if args:
+            _cc1_args_by_level[opt_level] = args
+        else:
+            # Keep going through the driver for this level
+            _cc1_args_by_level.pop(opt_level, None)
+
+
+def _ir_args(opt_level: str) -> list:
+    """clang arguments emitting LLVM IR for stdin at the given optimization level."""
+    args = _cc1_args_by_level.get(opt_level)
+    if args is not None:
+        return args
+    return _driver_args(opt_level)
+
+
+async def _compile_levels(source_code: str):
+    """
+    Run clang at O0 and O3 concurrently, feeding the source on stdin (-x c -)
+    so no temp file is needed.
+
+    Yields (level, returncode, stdout bytes, stderr bytes) as each finishes.
+    """
+    source_bytes = source_code.encode('utf-8')
+
+    # -S: Only run preprocess and compilation steps
+    # -emit-llvm: Use the LLVM representation for assembler and object files
+    # -O0: No optimization / -O3: Max optimization
+    # -I: Add include directory
+    async def compile_level(level):
+        returncode, stdout, stderr = await run_clang(
+            _ir_args(f"-{level.upper()}"), source_bytes
+        )
+        return level, returncode, stdout, stderr
+
+    tasks = [asyncio.create_task(compile_level(level)) for level in OPT_LEVELS]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Mark a second failure as retrieved; the first one is reported
+                task.exception()
+
+
+async def _optimize_events(source_code: str):
+    """
+    Yield {"level", "ir"} as each optimization level compiles, then a final
+    {"success"} event ({"success": False, "error"} if either level failed).
     """
-    Run clang to generate LLVM IR at O0 and O3 optimization levels.
+    errors = {}
+    try:
+        async for level, returncode, stdout, stderr in _compile_levels(source_code):
+            if returncode == 0:
+                yield {"level": level, "ir": stdout.decode('utf-8', errors='replace')}
+            else:
+                errors[level] = stderr.decode('utf-8', errors='replace')
+    except Exception as e:
+        yield {"success": False, "error": str(e)}
+        return
+
+    if errors:
+        error_msg = "\n".join(
+            f"{level.upper()} Error: {errors[level]}" for level in OPT_LEVELS if level in errors
+        )
+        yield {"success": False, "error": error_msg.strip()}
+    else:
+        yield {"success": True}
+
+
+async def stream_optimize(source_code: str):
+    """
+    Run clang to generate LLVM IR at O0 and O3 optimization levels, yielding
+    each level's IR as soon as its clang run finishes, then the final status.
+    Successful results are cached, and replayed as the same events.
     
     Args:
         source_code: C source code string
         
-    Returns:
-        dict with o0 and o3 LLVM IR code or error
+    Yields:
+        {"level": "o0"|"o3", "ir": str} events, then {"success": bool, "error"?: str}
     """
-    # Create temp file
-    with tempfile.NamedTemporaryFile(
-        mode='w',
-        suffix='.c',
-        delete=False,
-        encoding='utf-8'
-    ) as tmp_file:
-        tmp_file.write(source_code)
-        tmp_file_path = tmp_file.name
-    
-    try:
-        # Get absolute path to backend/include
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        include_dir = os.path.join(current_dir, 'include')
-        
-        # Run clang for O0 (No optimization)
-        # -S: Only run preprocess and compilation steps
-        # -emit-llvm: Use the LLVM representation for assembler and object files
-        # -O0: No optimization
-        # -I: Add include directory
-        process_o0 = subprocess.run(
-            ['clang', '-S', '-emit-llvm', '-O0', '-I', include_dir, tmp_file_path, '-o', '-'],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        
-        # Run clang for O3 (Max optimization)
-        process_o3 = subprocess.run(
-            ['clang', '-S', '-emit-llvm', '-O3', '-I', include_dir, tmp_file_path, '-o', '-'],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        
-        if process_o0.returncode == 0 and process_o3.returncode == 0:
-            return {
-                "success": True,
-                "o0": process_o0.stdout,
-                "o3": process_o3.stdout
-            }
-        else:
-            error_msg = ""
-            if process_o0.returncode != 0:
-                error_msg += f"O0 Error: {process_o0.stderr}\n"
-            if process_o3.returncode != 0:
-                error_msg += f"O3 Error: {process_o3.stderr}"
-            
-            return {
-                "success": False,
-                "error": error_msg.strip()
-            }
-            
-    except Exception as e:
-        return {
-            "success": False,
-            "error": str(e)
-        }
-    finally:
-        if os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-            except:
-                pass
+    key = result_cache.make_key("clang-ir", source_code, IR_CACHE_ARGS, [INCLUDE_DIR])
+    cached = result_cache.get(key)
+    if cached is not None:
+        for level in OPT_LEVELS:
+            yield {"level": level, "ir": cached[level]}
+        yield {"success": True}
+        return
+
+    ir_by_level = {}
+    async for event in _optimize_events(source_code):
+        if "level" in event:
+            ir_by_level[event["level"]] = event["ir"]
+        elif event["success"]:
+            result_cache.put(key, {"success": True, **{level: ir_by_level[level] for level in OPT_LEVELS}})
+        yield event
@@ -3,11 +3,13 @@ Preprocessor Service using clang.
 Runs the C preprocessor (clang -E) to expand macros and remove comments.
 """
 
-import subprocess
-import tempfile
-import os
+from clang_driver import INCLUDE_DIR, run_clang, stat_cache_flags
+from result_cache import cached_result
 
-def preprocess_c_code(source_code: str) -> dict:
+PREPROCESS_FLAGS = ['-E', '-P', '-I', INCLUDE_DIR]
+
+@cached_result("clang-pp", args=PREPROCESS_FLAGS, watch_dirs=[INCLUDE_DIR])
+async def preprocess_c_code(source_code: str) -> dict:
     """
     Run the C preprocessor on the source code.
     
@@ -17,43 +19,28 @@ def preprocess_c_code(source_code: str) -> dict:
     Returns:
         dict with success status and preprocessed code or error
     """
-    # Create temp file
-    with tempfile.NamedTemporaryFile(
-        mode='w',
-        suffix='.c',
-        delete=False,
-        encoding='utf-8'
-    ) as tmp_file:
-        tmp_file.write(source_code)
-        tmp_file_path = tmp_file.name
-    
     try:
-        # Get absolute path to backend/include
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        include_dir = os.path.join(current_dir, 'include')
-
-        # Run clang -E (preprocessor only)
+        # Run clang -E (preprocessor only), reading the source from stdin
         # -E: Run preprocessor stage
         # -C: Keep comments (optional, but usually preprocessed code has them removed. 
         #     User asked for "clean" expansion usually, but let's stick to standard behavior.
         #     Actually, let's omit -C to strip comments as per common expectation for "expanded" view)
         # -P: Disable linemarker output (makes it cleaner to read)
-        process = subprocess.run(
-            ['clang', '-E', '-P', '-I', include_dir, tmp_file_path],
-            capture_output=True,
-            text=True,
-            check=False
+        # -x c -: Treat stdin as C source
+        returncode, stdout, stderr = await run_clang(
+            PREPROCESS_FLAGS + stat_cache_flags() + ['-x', 'c', '-'],
+            source_code.encode('utf-8')
         )
         
-        if process.returncode == 0:
+        if returncode == 0:
             return {
                 "success": True,
-                "preprocessed_code": process.stdout
+                "preprocessed_code": stdout.decode('utf-8', errors='replace')
             }
         else:
             return {
                 "success": False,
-                "error": process.stderr
+                "error": stderr.decode('utf-8', errors='replace')
             }
             
     except Exception as e:
@@ -61,6 +48,3 @@ def preprocess_c_code(source_code: str) -> dict:
             "success": False,
             "error": str(e)
         }
-    finally:
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
@@ -0,0 +1,148 @@
+"""
+Result Cache.
+Content-addressed in-memory and on-disk cache for analysis results, so that
+re-submitting the same source code skips libclang entirely.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import tempfile
+from collections import OrderedDict
+
+import orjson
+
+CACHE_DIR = os.getenv("CVIZ_CACHE_DIR", os.path.join(tempfile.gettempdir(), "c-viz-cache"))
+MAX_MEMORY_ENTRIES = 128
+MAX_DISK_ENTRIES = 1024
+
+_memory_cache = OrderedDict()  # key -> result dict (most recently used last)
+
+
+def _dir_fingerprint(path: str) -> str:
+    """Fingerprint a directory by its own mtime and the mtimes of its entries."""
+    try:
+        parts = [str(os.stat(path).st_mtime_ns)]
+        with os.scandir(path) as entries:
+            for entry in entries:
+                parts.append(f"{entry.name}:{entry.stat().st_mtime_ns}")
+    except OSError:
+        return ""
+    parts.sort()
+    return "|".join(parts)
+
+
+def make_key(namespace: str, source_code: str, args=(), watch_dirs=()) -> str:
+    """
+    Build a cache key from the source, compiler arguments and the state of
+    any directories (e.g. backend/include) the result depends on.
+    """
+    h = hashlib.sha256()
+    h.update(namespace.encode('utf-8'))
+    h.update(b"\0")
+    h.update(source_code.encode('utf-8'))
+    for arg in args:
+        h.update(b"\0")
+        h.update(arg.encode('utf-8'))
+    for path in watch_dirs:
+        h.update(b"\0")
+        h.update(_dir_fingerprint(path).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get(key: str):
+    """Return a cached result, or None on a miss."""
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        return _memory_cache[key]
+
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, 'rb') as f:
+            result = orjson.loads(f.read())
+        # Touch the entry so eviction treats it as recently used
+        os.utime(path)
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+    _remember(key, result)
+    return result
+
+
+def put(key: str, result: dict):
+    """Store a result in memory and on disk (best effort)."""
+    _remember(key, result)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, f"{key}.json")
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(orjson.dumps(result))
+        os.replace(tmp_path, path)
+        _evict_disk()
+    except (OSError, TypeError, orjson.JSONEncodeError) as e:
+        print(f"[Cache] Could not write cache entry: {e}")
+
+
+def _remember(key: str, result: dict):
+    _memory_cache[key] = result
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > MAX_MEMORY_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+
+def _evict_disk():
+    """Drop the least recently used entries once the directory grows too large."""
+    with os.scandir(CACHE_DIR) as entries:
+        files = [(entry.stat().st_mtime_ns, entry.path) for entry in entries
+                 if entry.name.endswith('.json')]
+    if len(files) <= MAX_DISK_ENTRIES:
+        return
+
+    files.sort()
+    for _, path in files[:len(files) - MAX_DISK_ENTRIES]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def cached_result(namespace: str, args=(), watch_dirs=()):
+    """
+    Decorator for `fn(source_code, ...) -> dict` services.
+    Only successful results are cached; cached results must be treated as read-only.
+    Extra arguments (e.g. a session id) are passed through but are not part of
+    the key, so they must not change the result. Coroutine functions get an
+    async wrapper.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(source_code: str, *fn_args, **fn_kwargs) -> dict:
+                key = make_key(namespace, source_code, args, watch_dirs)
+                result = get(key)
+                if result is not None:
+                    return result
+
+                result = await fn(source_code, *fn_args, **fn_kwargs)
+                if result.get("success"):
+                    put(key, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(source_code: str, *fn_args, **fn_kwargs) -> dict:
+            key = make_key(namespace, source_code, args, watch_dirs)
+            result = get(key)
+            if result is not None:
+                return result
+
+            result = fn(source_code, *fn_args, **fn_kwargs)
+            if result.get("success"):
+                put(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -3,18 +3,44 @@ Static Analyzer for C code.
 Extracts symbol table and performs basic static analysis checks.
 """
 
+from collections import defaultdict
+from itertools import islice
+
 from clang.cindex import CursorKind
 
+from clang_session import file_key
+
+# CursorKind members are singletons: bind the ones tested per cursor once
+# and compare by identity rather than going through CursorKind.<NAME> lookups
+_FUNCTION_DECL = CursorKind.FUNCTION_DECL
+_VAR_DECL = CursorKind.VAR_DECL
+_PARM_DECL = CursorKind.PARM_DECL
+_DECL_REF_EXPR = CursorKind.DECL_REF_EXPR
+_WHILE_STMT = CursorKind.WHILE_STMT
+_FOR_STMT = CursorKind.FOR_STMT
+_DO_STMT = CursorKind.DO_STMT
+_INTEGER_LITERAL = CursorKind.INTEGER_LITERAL
+_BREAK_STMT = CursorKind.BREAK_STMT
+
 
 class StaticAnalyzer:
     """Performs static analysis on C code AST."""
     
     def __init__(self):
-        self.symbol_table = []
+        # Symbol table as parallel columns; rows are built once in analyze()
+        self._sym_names = []
+        self._sym_kinds = []
+        self._sym_types = []
+        self._sym_scopes = []
+        self._sym_lines = []
+        self._sym_columns = []
         self.diagnostics = []
-        self.declared_vars = {}  # {name: {line, scope, type, used}}
+        self.loop_stack = []  # frames of the loops enclosing the current cursor
+        self.loop_candidates = []  # while(1)/for(;;) frames, in source order
+        self.declared_vars = defaultdict(dict)  # {scope: {name: {name, line, scope, used}}}
         self.current_scope = "global"
         self.scope_stack = ["global"]
+        self._file_cache = {}  # file_key -> is from source file
     
     def analyze(self, cursor, source_file_path: str):
         """
@@ -25,20 +51,48 @@ class StaticAnalyzer:
             source_file_path: Path to the source file being analyzed
         """
         self.source_file = source_file_path
-        self._traverse_for_symbols(cursor)
+        self._walk(cursor)
         self._check_unused_variables()
-        self._check_infinite_loops(cursor)
+        # Loop warnings follow the unused-variable ones
+        self.diagnostics.extend(
+            frame["warning"] for frame in self.loop_candidates if not frame["has_break"]
+        )
         
         return {
-            "symbolTable": self.symbol_table,
+            "symbolTable": self._symbol_rows(),
             "diagnostics": self.diagnostics
         }
     
-    def _is_from_source(self, cursor) -> bool:
-        """Check if cursor is from our source file, not headers."""
-        if cursor.location.file:
-            return cursor.location.file.name == self.source_file
-        return False
+    def _add_symbol(self, name, kind, type_str, scope, line, column):
+        self._sym_names.append(name)
+        self._sym_kinds.append(kind)
+        self._sym_types.append(type_str)
+        self._sym_scopes.append(scope)
+        self._sym_lines.append(line)
+        self._sym_columns.append(column)
+    
+    def _symbol_rows(self) -> list:
+        """Materialize the symbol columns into the API's list of dicts."""
+        return [
+            {"name": name, "kind": kind, "type": type_str, "scope": scope, "line": line, "column": column}
+            for name, kind, type_str, scope, line, column in zip(
+                self._sym_names, self._sym_kinds, self._sym_types,
+                self._sym_scopes, self._sym_lines, self._sym_columns
+            )
+        ]
+    
+    def _is_from_source(self, loc) -> bool:
+        """Check if a location is in our source file, not headers."""
+        source_file = loc.file
+        if not source_file:
+            return False
+        # cindex wraps the same CXFile anew on every access, so compare by
+        # handle and only fetch/compare the file name once per file
+        key = file_key(source_file)
+        from_source = self._file_cache.get(key)
+        if from_source is None:
+            from_source = self._file_cache[key] = (source_file.name == self.source_file)
+        return from_source
     
     def _get_type_string(self, cursor) -> str:
         """Extract type string from cursor."""
@@ -47,158 +101,157 @@ class StaticAnalyzer:
         except:
             return "unknown"
     
-    def _traverse_for_symbols(self, cursor, depth: int = 0):
-        """Traverse AST to extract symbols and build symbol table."""
+    def _walk(self, root):
+        """
+        Single iterative pre-order walk that extracts symbols, marks usages
+        and checks loops. Each stack entry holds a cursor's kind and the
+        iterator over its remaining children, so leaving a node is explicit.
+        """
+        stack = [(self._visit(root), root.get_children())]
         
-        # Handle scope changes
-        if cursor.kind == CursorKind.FUNCTION_DECL:
-            func_name = cursor.spelling
-            self.scope_stack.append(func_name)
-            self.current_scope = func_name
-            
-            # Add function to symbol table
-            if self._is_from_source(cursor):
-                self.symbol_table.append({
-                    "name": func_name,
-                    "kind": "function",
-                    "type": self._get_type_string(cursor),
-                    "scope": "global",
-                    "line": cursor.location.line,
-                    "column": cursor.location.column
-                })
+        while stack:
+            kind, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                leave = _LEAVE_HANDLERS.get(kind)
+                if leave is not None:
+                    leave(self)
+                continue
+            stack.append((self._visit(child), child.get_children()))
+    
+    def _visit(self, cursor):
+        """Handle a cursor on the way down. Returns its kind."""
+        # Every cursor attribute read crosses into libclang: read each once
+        kind = cursor.kind
+        handler = _VISIT_HANDLERS.get(kind)
+        if handler is not None:
+            handler(self, cursor, kind)
+        return kind
+    
+    def _visit_function(self, cursor, kind):
+        """Enter a function scope and record the function."""
+        func_name = cursor.spelling
+        self.scope_stack.append(func_name)
+        self.current_scope = func_name
+        
+        # Add function to symbol table
+        loc = cursor.location
+        if self._is_from_source(loc):
+            self._add_symbol(func_name, "function", self._get_type_string(cursor),
+                             "global", loc.line, loc.column)
+    
+    def _visit_declaration(self, cursor, kind):
+        """Record a variable or parameter declaration."""
+        loc = cursor.location
+        if not self._is_from_source(loc):
+            return
+        name = cursor.spelling
+        line = loc.line
         
-        # Variable declarations
-        if cursor.kind == CursorKind.VAR_DECL and self._is_from_source(cursor):
-            var_name = cursor.spelling
-            var_type = self._get_type_string(cursor)
-            
-            self.symbol_table.append({
-                "name": var_name,
-                "kind": "variable",
-                "type": var_type,
-                "scope": self.current_scope,
-                "line": cursor.location.line,
-                "column": cursor.location.column
-            })
-            
-            # Track for unused variable detection
-            key = f"{self.current_scope}:{var_name}"
-            self.declared_vars[key] = {
-                "name": var_name,
-                "line": cursor.location.line,
-                "scope": self.current_scope,
-                "used": False
-            }
+        self._add_symbol(name, "variable" if kind is _VAR_DECL else "parameter",
+                         self._get_type_string(cursor), self.current_scope, line, loc.column)
         
-        # Parameter declarations
-        if cursor.kind == CursorKind.PARM_DECL and self._is_from_source(cursor):
-            param_name = cursor.spelling
-            param_type = self._get_type_string(cursor)
-            
-            self.symbol_table.append({
-                "name": param_name,
-                "kind": "parameter",
-                "type": param_type,
-                "scope": self.current_scope,
-                "line": cursor.location.line,
-                "column": cursor.location.column
-            })
-            
-            # Track for unused parameter detection
-            key = f"{self.current_scope}:{param_name}"
-            self.declared_vars[key] = {
-                "name": param_name,
-                "line": cursor.location.line,
-                "scope": self.current_scope,
-                "used": False
-            }
+        # Track for unused variable/parameter detection
+        self.declared_vars[self.current_scope][name] = {
+            "name": name,
+            "line": line,
+            "scope": self.current_scope,
+            "used": False
+        }
+    
+    def _visit_reference(self, cursor, kind):
+        """Track variable references (usage)."""
+        ref_name = cursor.spelling
+        # Mark as used in current scope or global
+        for scope in (self.current_scope, "global"):
+            scope_vars = self.declared_vars.get(scope)
+            if scope_vars and ref_name in scope_vars:
+                scope_vars[ref_name]["used"] = True
+                break
+    
+    def _visit_loop(self, cursor, kind):
+        """Track the innermost loop so a break can be attributed to it."""
+        frame = {"has_break": False}
+        self.loop_stack.append(frame)
         
-        # Track variable references (usage)
-        if cursor.kind == CursorKind.DECL_REF_EXPR:
-            ref_name = cursor.spelling
-            # Mark as used in current scope or global
-            for scope in [self.current_scope, "global"]:
-                key = f"{scope}:{ref_name}"
-                if key in self.declared_vars:
-                    self.declared_vars[key]["used"] = True
-                    break
+        loc = cursor.location
+        if kind is _DO_STMT or not self._is_from_source(loc):
+            return
         
-        # Recurse into children
-        for child in cursor.get_children():
-            self._traverse_for_symbols(child, depth + 1)
+        if kind is _WHILE_STMT:
+            # Check for while(1) or while(true)
+            condition = next(cursor.get_children(), None)
+            if condition is None or condition.kind is not _INTEGER_LITERAL:
+                return
+            # Get the literal value if possible
+            token = next(condition.get_tokens(), None)
+            if token is None or token.spelling not in ('1', 'true'):
+                return
+            pattern = "while(1)"
+        else:
+            # for(;;) has minimal children and no condition
+            if len(list(islice(cursor.get_children(), 2))) > 1:
+                return
+            pattern = "for(;;)"
         
-        # Pop scope when leaving function
-        if cursor.kind == CursorKind.FUNCTION_DECL:
-            self.scope_stack.pop()
-            self.current_scope = self.scope_stack[-1] if self.scope_stack else "global"
+        # Reported after the walk unless a break inside this loop is seen
+        frame["warning"] = {
+            "severity": "warning",
+            "code": "W002",
+            "message": f"Potential infinite loop detected ({pattern} without break)",
+            "line": loc.line,
+            "scope": self.current_scope
+        }
+        self.loop_candidates.append(frame)
+    
+    def _visit_break(self, cursor, kind):
+        """A break exits (only) the innermost enclosing loop."""
+        if self.loop_stack:
+            self.loop_stack[-1]["has_break"] = True
+    
+    def _leave_function(self):
+        """Pop scope when leaving function."""
+        self.scope_stack.pop()
+        self.current_scope = self.scope_stack[-1] if self.scope_stack else "global"
+    
+    def _leave_loop(self):
+        """Drop the loop frame once the loop body is done."""
+        self.loop_stack.pop()
     
     def _check_unused_variables(self):
         """Detect unused variables and parameters."""
-        for key, info in self.declared_vars.items():
-            if not info["used"]:
-                self.diagnostics.append({
-                    "severity": "warning",
-                    "code": "W001",
-                    "message": f"Unused variable '{info['name']}'",
-                    "line": info["line"],
-                    "scope": info["scope"]
-                })
-    
-    def _check_infinite_loops(self, cursor):
-        """Detect potential infinite loops."""
-        self._check_infinite_loops_recursive(cursor)
-    
-    def _check_infinite_loops_recursive(self, cursor):
-        """Recursively check for infinite loop patterns."""
-        
-        # Check for while(1) or while(true)
-        if cursor.kind == CursorKind.WHILE_STMT and self._is_from_source(cursor):
-            children = list(cursor.get_children())
-            if children:
-                condition = children[0]
-                # Check for literal 1 or constant true
-                if condition.kind == CursorKind.INTEGER_LITERAL:
-                    # Get the literal value if possible
-                    tokens = list(condition.get_tokens())
-                    if tokens and tokens[0].spelling in ['1', 'true']:
-                        # Check if there's a break statement in the body
-                        has_break = self._has_break_statement(cursor)
-                        if not has_break:
-                            self.diagnostics.append({
-                                "severity": "warning",
-                                "code": "W002",
-                                "message": "Potential infinite loop detected (while(1) without break)",
-                                "line": cursor.location.line,
-                                "scope": self.current_scope
-                            })
-        
-        # Check for for(;;) - empty condition
-        if cursor.kind == CursorKind.FOR_STMT and self._is_from_source(cursor):
-            children = list(cursor.get_children())
-            # for(;;) has minimal children and no condition
-            if len(children) <= 1:
-                has_break = self._has_break_statement(cursor)
-                if not has_break:
+        for scope, scope_vars in self.declared_vars.items():
+            for name, info in scope_vars.items():
+                if not info["used"]:
                     self.diagnostics.append({
-                        "severity": "warning", 
-                        "code": "W002",
-                        "message": "Potential infinite loop detected (for(;;) without break)",
-                        "line": cursor.location.line,
-                        "scope": self.current_scope
+                        "severity": "warning",
+                        "code": "W001",
+                        "message": f"Unused variable '{name}'",
+                        "line": info["line"],
+                        "scope": scope
                     })
-        
-        # Recurse
-        for child in cursor.get_children():
-            self._check_infinite_loops_recursive(child)
-    
-    def _has_break_statement(self, cursor) -> bool:
-        """Check if a loop body contains a break statement."""
-        for child in cursor.get_children():
-            if child.kind == CursorKind.BREAK_STMT:
-                return True
-            if self._has_break_statement(child):
-                return True
-        return False
+
+
+# Cursor kind -> StaticAnalyzer method run on the way down
+_VISIT_HANDLERS = {
+    _FUNCTION_DECL: StaticAnalyzer._visit_function,
+    _VAR_DECL: StaticAnalyzer._visit_declaration,
+    _PARM_DECL: StaticAnalyzer._visit_declaration,
+    _DECL_REF_EXPR: StaticAnalyzer._visit_reference,
+    _WHILE_STMT: StaticAnalyzer._visit_loop,
+    _FOR_STMT: StaticAnalyzer._visit_loop,
+    _DO_STMT: StaticAnalyzer._visit_loop,
+    _BREAK_STMT: StaticAnalyzer._visit_break,
+}
+
+# Cursor kind -> StaticAnalyzer method run once its children are done
+_LEAVE_HANDLERS = {
+    _FUNCTION_DECL: StaticAnalyzer._leave_function,
+    _WHILE_STMT: StaticAnalyzer._leave_loop,
+    _FOR_STMT: StaticAnalyzer._leave_loop,
+    _DO_STMT: StaticAnalyzer._leave_loop,
+}
 
 
 def analyze_code(cursor, source_file_path: str) -> dict:
@@ -2,9 +2,16 @@ import { createContext, useContext, useState, useCallback } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { DEFAULT_CODE } from '../utils/codeExamples';
+import { buildAstTree } from '../utils/astConverter';
+import { readNdjson } from '../utils/ndjson';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Identifies this tab to the backend, which keeps a warm libclang parse per session
+// (crypto.randomUUID is only available in secure contexts)
+const SESSION_ID = globalThis.crypto?.randomUUID?.() ?? Math.random().toString(36).slice(2);
+const SESSION_HEADERS = { headers: { 'X-Session-Id': SESSION_ID } };
+
 // Create the context
 const ASTContext = createContext(null);
 
@@ -31,17 +38,18 @@ export function ASTProvider({ children }) {
         try {
             // Fetch both AST and CFG in parallel
             const [astResponse, cfgResponse] = await Promise.all([
-                axios.post(`${API_BASE_URL}/api/parse`, { code: sourceCode }),
-                axios.post(`${API_BASE_URL}/api/cfg`, { code: sourceCode })
+                axios.post(`${API_BASE_URL}/api/parse`, { code: sourceCode }, SESSION_HEADERS),
+                axios.post(`${API_BASE_URL}/api/cfg`, { code: sourceCode }, SESSION_HEADERS)
             ]);
 
             // Process AST response
             if (astResponse.data.success) {
-                setAstData(astResponse.data.ast);
+                const flatAst = astResponse.data.ast || [];
+                setAstData(buildAstTree(flatAst));
                 setSymbolTable(astResponse.data.symbolTable || []);
                 setDiagnostics(astResponse.data.diagnostics || []);
 
-                const nodeCount = countNodes(astResponse.data.ast);
+                const nodeCount = flatAst.length;
                 const diagCount = astResponse.data.diagnostics?.length || 0;
                 const parseErrors = astResponse.data.errors || [];
 
@@ -82,7 +90,7 @@ export function ASTProvider({ children }) {
             // Process CFG response
             if (cfgResponse.data.success) {
                 setCfgData(cfgResponse.data.cfg);
-                const cfgNodeCount = cfgResponse.data.cfg?.nodes?.length || 0;
+                const cfgNodeCount = cfgResponse.data.cfg?.block_ids?.length || 0;
                 console.log(`CFG generated: ${cfgNodeCount} basic blocks`);
             } else {
                 setCfgData(null);
@@ -149,12 +157,29 @@ export function ASTProvider({ children }) {
         if (!sourceCode.trim()) return;
 
         try {
-            const response = await axios.post(`${API_BASE_URL}/api/optimize`, { code: sourceCode });
-            if (response.data.success) {
-                setOptimizationData(response.data);
-                toast.success('Optimization analysis complete');
-            } else {
-                toast.error('Optimization analysis failed', { description: response.data.error });
+            // Streamed as NDJSON: one line per optimization level as soon as it
+            // compiles, then a final status line
+            const response = await fetch(`${API_BASE_URL}/api/optimize`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ code: sourceCode })
+            });
+            if (!response.ok) {
+                throw new Error(`Request failed with status code ${response.status}`);
+            }
+
+            let irByLevel = {};
+            for await (const event of readNdjson(response)) {
+                if (event.level) {
+                    // Open the view with the first level; it shows a loader until both arrive
+                    irByLevel = { ...irByLevel, [event.level]: event.ir };
+                    setOptimizationData({ success: true, ...irByLevel });
+                } else if (event.success) {
+                    toast.success('Optimization analysis complete');
+                } else {
+                    setOptimizationData(null);
+                    toast.error('Optimization analysis failed', { description: event.error });
+                }
             }
         } catch (err) {
             toast.error('Optimization request failed', { description: err.message });
@@ -190,18 +215,6 @@ export function ASTProvider({ children }) {
     );
 }
 
-// Helper to count AST nodes
-function countNodes(node) {
-    if (!node) return 0;
-    let count = 1;
-    if (node.children) {
-        for (const child of node.children) {
-            count += countNodes(child);
-        }
-    }
-    return count;
-}
-
 // Custom hook
 export function useAST() {
     const context = useContext(ASTContext);
@@ -90,6 +90,32 @@ function applyDagreLayout(nodes, edges) {
     return layoutedNodes;
 }
 
+/**
+ * Rebuild the recursive AST from the backend's flat, pre-order node list.
+ * Each node carries its parent's index (-1 for the root).
+ */
+export function buildAstTree(flatNodes) {
+    if (!flatNodes || flatNodes.length === 0) return null;
+
+    const nodes = flatNodes.map((node, idx) => ({
+        id: `n${idx}`,
+        type: node.type,
+        name: node.name,
+        line: node.line,
+        column: node.column,
+        children: []
+    }));
+
+    // Parents precede children, and siblings arrive in source order
+    flatNodes.forEach((node, idx) => {
+        if (node.parent >= 0) {
+            nodes[node.parent].children.push(nodes[idx]);
+        }
+    });
+
+    return nodes[0];
+}
+
 /**
  * Main function: Convert AST to React Flow format
  */
@@ -50,16 +50,52 @@ function getLayoutedElements(nodes, edges) {
     return { nodes: layoutedNodes, edges };
 }
 
+/**
+ * Rebuild blocks and edges from the backend's columnar CFG payload.
+ * Statements and edges reference blocks by index into `block_ids`.
+ */
+function expandCfg(cfgData) {
+    const blocks = cfgData.block_ids.map((id, idx) => ({
+        id,
+        label: cfgData.labels[idx],
+        statements: [],
+        isEntry: cfgData.is_entry[idx],
+        isExit: cfgData.is_exit[idx]
+    }));
+
+    cfgData.stmts_owner.forEach((owner, idx) => {
+        blocks[owner].statements.push({
+            text: cfgData.stmts_text[idx],
+            line: cfgData.stmts_line[idx]
+        });
+    });
+
+    const edges = cfgData.edges_src.map((src, idx) => {
+        const source = cfgData.block_ids[src];
+        const target = cfgData.block_ids[cfgData.edges_tgt[idx]];
+        return {
+            id: `edge_${source}_${target}`,
+            source,
+            target,
+            label: cfgData.edges_label[idx]
+        };
+    });
+
+    return { blocks, edges };
+}
+
 /**
  * Convert CFG data from backend to React Flow format.
  */
 export function cfgToReactFlow(cfgData) {
-    if (!cfgData || !cfgData.nodes) {
+    if (!cfgData || !cfgData.block_ids) {
         return { nodes: [], edges: [] };
     }
 
+    const { blocks, edges: cfgEdges } = expandCfg(cfgData);
+
     // Convert nodes
-    const nodes = cfgData.nodes.map((block) => ({
+    const nodes = blocks.map((block) => ({
         id: block.id,
         type: 'cfgNode',
         data: {
@@ -72,7 +108,7 @@ export function cfgToReactFlow(cfgData) {
     }));
 
     // Convert edges with labels
-    const edges = cfgData.edges.map((edge) => ({
+    const edges = cfgEdges.map((edge) => ({
         id: edge.id,
         source: edge.source,
         target: edge.target,
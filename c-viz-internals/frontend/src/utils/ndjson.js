@@ -0,0 +1,25 @@
+/**
+ * Incrementally parse a newline-delimited JSON (NDJSON) fetch response.
+ * Yields each JSON object as soon as its line has arrived.
+ */
+export async function* readNdjson(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) !== -1) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) yield JSON.parse(line);
+        }
+    }
+
+    buffer += decoder.decode();
+    if (buffer.trim()) yield JSON.parse(buffer);
+}